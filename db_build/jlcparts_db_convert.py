@@ -5,11 +5,11 @@
 This replaces the old .csv based database creation that JLCPCB no longer supports.
 """
 
-import copy
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, datetime
-import json
 import os
 from pathlib import Path
+import re
 import shutil
 import sqlite3
 import subprocess
@@ -17,15 +17,49 @@ import sys
 import time
 import urllib.request
 import zipfile
-from zipfile import ZipFile
+from zipfile import ZipFile, ZipInfo
 
 import click
 import humanize
 
+try:
+    # orjson parses the per part price json several times faster
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# column order of the rows inserted into the parts table
+PARTS_COLUMNS = (
+    "LCSC Part",
+    "First Category",
+    "Second Category",
+    "MFR.Part",
+    "Package",
+    "Solder Joint",
+    "Manufacturer",
+    "Library Type",
+    "Description",
+    "Datasheet",
+    "Price",
+    "Stock",
+)
+
+# built once so sqlite3's statement cache reuses the prepared statement
+PARTS_INSERT_SQL = "INSERT INTO parts ({}) VALUES ({})".format(
+    ", ".join(f'"{c}"' for c in PARTS_COLUMNS),
+    ", ".join(["?"] * len(PARTS_COLUMNS)),
+)
+
+# runs of spaces left behind after removing parts of the description
+MULTIPLE_SPACES = re.compile(" {2,}")
+
 
 class PriceEntry:
     """Price for a quantity range."""
 
+    # several are created for every part, skip the per instance __dict__
+    __slots__ = ("min_quantity", "max_quantity", "price_dollars_str", "price_dollars")
+
     def __init__(self, min_quantity: int, max_quantity: int | None, price_dollars: str):
         self.min_quantity = min_quantity
         self.max_quantity = max_quantity
@@ -109,34 +143,22 @@ class Price:
     def filter_duplicate_prices(entries: list[PriceEntry]) -> list[PriceEntry]:
         """Remove entries with duplicate price_dollar_str values, merging quantities so there aren't gaps."""
 
-        # copy.deepcopy() is used to value modifications from altering the original values.
         price_entries_unique: list[PriceEntry] = []
-        if len(entries) > 1:
-            first = 0
-            second = 1
-            f: PriceEntry | None = None
-            while True:
-                if f is None:
-                    f = copy.deepcopy(entries[first])
-
-                # stop when the second element is at the end of the list
-                if second >= len(entries):
-                    break
-
-                # if match, copy over the quantity and advance the second, keep searching for a mismatch
-                if f.price_dollars_str == entries[second].price_dollars_str:
-                    f.max_quantity = entries[second].max_quantity
-                    second += 1
-                else:  # if no match, add the first and then start looking at the second
-                    price_entries_unique.append(f)
-                    first = second
-                    second = first + 1
-                    f = None
-
-            # always add the final first entry when we run out of elements to process
-            price_entries_unique.append(f)
-        else:  # only a single entry, nothing to de-duplicate
-            price_entries_unique = entries
+        for entry in entries:
+            # only adjacent entries with the same price are merged
+            if (
+                price_entries_unique
+                and price_entries_unique[-1].price_dollars_str
+                == entry.price_dollars_str
+            ):
+                # extend the kept entry over this quantity range, a new entry is
+                # created to avoid altering the original values
+                last = price_entries_unique[-1]
+                price_entries_unique[-1] = PriceEntry(
+                    last.min_quantity, entry.max_quantity, last.price_dollars_str
+                )
+            else:
+                price_entries_unique.append(entry)
 
         return price_entries_unique
 
@@ -150,6 +172,7 @@ class Generate:
         chunk_num: Path = Path("chunk_num_fts5.txt"),
         obsolete_parts_threshold_days: int = 0,
         skip_cleanup: bool = False,
+        batch_size: int = 100000,
     ):
         self.output_db = output_db
         self.jlcparts_db_name = "cache.sqlite3"
@@ -157,6 +180,8 @@ class Generate:
         self.chunk_num = chunk_num
         self.skip_cleanup = skip_cleanup
         self.obsolete_parts_threshold_days = obsolete_parts_threshold_days
+        # number of components read from the jlcparts db per fetchmany()
+        self.batch_size = batch_size
 
     def remove_original(self):
         """Remove the original output database."""
@@ -166,15 +191,35 @@ class Generate:
     def connect_sqlite(self):
         """Connect to the sqlite databases."""
         # connection to the jlcparts db
-        db_uri = f"file:{self.jlcparts_db_name}?mode=rw"
+        db_uri = f"file:{self.jlcparts_db_name}?mode=ro"
         self.conn_jp = sqlite3.connect(db_uri, uri=True)
+        # it is only scanned, map it instead of copying pages through the page cache
+        # (sqlite caps this at its compile time SQLITE_MAX_MMAP_SIZE)
+        self.conn_jp.execute("PRAGMA mmap_size = 17179869184")
 
         # connection to the plugin db we want to write
         self.conn = sqlite3.connect(self.output_db)
 
+        # the output db is rebuilt from scratch on every run, so trade durability
+        # for bulk load speed. WAL is avoided as it would persist in the shipped file.
+        # page_size has to be set before the first table is created, 16 KiB gave
+        # the smallest db and zip.
+        self.conn.executescript(
+            """
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            PRAGMA temp_store = MEMORY;
+            PRAGMA cache_size = -128000;
+            PRAGMA locking_mode = EXCLUSIVE;
+            PRAGMA page_size = 16384;
+            """
+        )
+
     def meta_data(self):
         """Populate the metadata table."""
         # metadata
+        # commit the pending changes first so the size on disk is final
+        self.conn.commit()
         db_size = os.stat(self.output_db).st_size
         self.conn.execute(
             "INSERT INTO meta VALUES(?, ?, ?, ?, ?)",
@@ -196,8 +241,15 @@ class Generate:
     def compress(self):
         """Compress the output database into a new compressed file."""
         print(f"Compressing {self.output_db}")
-        with ZipFile(self.compressed_output_db, "w", zipfile.ZIP_DEFLATED) as zf:
-            zf.write(self.output_db)
+        # stream with 1 MiB reads, ZipFile.write() feeds deflate in 8 KiB pieces
+        info = ZipInfo.from_file(self.output_db)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with (
+            ZipFile(self.compressed_output_db, "w", zipfile.ZIP_DEFLATED) as zf,
+            open(self.output_db, "rb") as src,
+            zf.open(info, "w") as dst,
+        ):
+            shutil.copyfileobj(src, dst, 1024 * 1024)
 
     def split(self):
         """Split the compressed so we stay below githubs 100M limit."""
@@ -208,23 +260,29 @@ class Generate:
         # Open the zip file for byte-reading
         print(f"Chunking {self.compressed_output_db}")
         with open(self.compressed_output_db, "rb") as z:
-            # Read the file data in chunks
-            chunk = z.read(split_size)
-            chunk_num = 1
+            size = os.fstat(z.fileno()).st_size
+            offset = 0
+            chunk_num = 0
 
-            while chunk:
+            while offset < size:
+                chunk_num += 1
+                end = min(offset + split_size, size)
                 split_file_name = f"{self.compressed_output_db}.{chunk_num:03}"
                 with open(split_file_name, "wb") as split_file:
-                    # Write the chunk to the new split file
-                    split_file.write(chunk)
-
-                # Read the next chunk of data from the file
-                chunk = z.read(split_size)
-                chunk_num += 1
+                    # Copy the chunk to the new split file inside the kernel
+                    try:
+                        while offset < end:
+                            offset += os.sendfile(
+                                split_file.fileno(), z.fileno(), offset, end - offset
+                            )
+                    except (AttributeError, OSError):
+                        # no file to file sendfile (Windows, macOS), copy it instead
+                        z.seek(offset)
+                        split_file.write(z.read(end - offset))
+                        offset = end
 
             # create a helper file for the downloader which indicates the number of chunk files
-            with open(self.chunk_num, "w", encoding="utf-8") as f:
-                f.write(str(chunk_num - 1))
+            self.chunk_num.write_bytes(str(chunk_num).encode("ascii"))
 
     def display_stats(self):
         """Print out some stats."""
@@ -266,7 +324,7 @@ class Generate:
         # Solder Joint is unindexed as it contains a numerical count that isn't particular helpful for token searching
         # Price is unindexed as it isn't helpful for token searching
         # Stock is unindexed as it isn't helpful for token searching
-        self.conn.execute(
+        self.conn.executescript(
             """
             CREATE virtual TABLE IF NOT EXISTS parts using fts5 (
                 'LCSC Part',
@@ -281,50 +339,143 @@ class Generate:
                 'Datasheet' unindexed,
                 'Price' unindexed,
                 'Stock' unindexed
-            , tokenize="trigram")
-            """
-        )
+            , tokenize="trigram");
 
-        self.conn.execute(
-            """
             CREATE TABLE IF NOT EXISTS mapping (
                 'footprint',
                 'value',
                 'LCSC'
-            )
-            """
-        )
+            );
 
-        self.conn.execute(
-            """
             CREATE TABLE IF NOT EXISTS meta (
                 'filename',
                 'size',
                 'partcount',
                 'date',
                 'last_update'
-            )
-            """
-        )
+            );
 
-        self.conn.execute(
-            """
             CREATE TABLE IF NOT EXISTS categories (
                 'First Category',
                 'Second Category'
-            )
+            );
             """
         )
 
     @staticmethod
-    def library_type(row: sqlite3.Row) -> str:
+    def library_type(basic: int, preferred: int) -> str:
         """Return library type string."""
-        if row["basic"]:
+        if basic:
             return "Basic"
-        if row["preferred"]:
+        if preferred:
             return "Preferred"
         return "Extended"
 
+    def part_rows(self, comps, cats, mans):
+        """Yield the parts table rows for a batch of jlcparts components."""
+        # columns in the order of the components query in load_tables
+        for (
+            lcsc,
+            category_id,
+            mfr,
+            package,
+            joints,
+            manufacturer_id,
+            basic,
+            preferred,
+            # already overridden by the 'description' property from 'extra'
+            # where present, see the json_extract() in the query
+            description,
+            datasheet,
+            stock,
+            price_json,
+        ) in comps:
+            priceInput = json_loads(price_json)
+
+            # parse the price field
+            price = Price(priceInput)
+
+            price_entries = Price.reduce_precision(price.price_entries)
+            self.price_entries_total += len(price_entries)
+
+            price_str: str = ""
+
+            # filter parts priced below the cutoff value
+            price_entries_cutoff = Price.filter_below_cutoff(price_entries, 0.01)
+            self.price_entries_deleted_total += len(price_entries) - len(
+                price_entries_cutoff
+            )
+
+            # alias the variable for the next step
+            price_entries = price_entries_cutoff
+
+            # remove duplicates
+            price_entries_unique = Price.filter_duplicate_prices(price_entries)
+            self.price_entries_duplicates_deleted_total += len(price_entries) - len(
+                price_entries_unique
+            )
+            self.price_entries_deleted_total += len(price_entries) - len(
+                price_entries_unique
+            )
+
+            # alias over the variable for the next step
+            price_entries = price_entries_unique
+
+            # build the output string that is stored into the parts database
+            price_str = ",".join(
+                [
+                    f"{entry.min_quantity}-{entry.max_quantity if entry.max_quantity is not None else ''}:{entry.price_dollars_str}"
+                    for entry in price_entries
+                ]
+            )
+
+            # strip ROHS out of descriptions where present
+            # and add 'not ROHS' where ROHS is not present
+            # as 99% of parts are ROHS at this point
+            if " rohs" not in description.lower():
+                description += " not ROHS"
+            else:
+                description = description.replace(" ROHS", "")
+
+            # look the category up once, it is used for several columns
+            category = cats[category_id]
+            first_category, second_category = category
+
+            # remember the category to populate the categories table later on
+            self.seen_categories.add(category)
+
+            # strip the 'Second category' out of the description if it
+            # is duplicated there
+            description = description.replace(second_category, "")
+
+            # remove 'Package' from the description if it is duplicated there
+            description = description.replace(package, "")
+
+            # replace double spaces with single spaces in description
+            description = MULTIPLE_SPACES.sub(" ", description)
+
+            # remove trailing spaces from description
+            description = description.strip()
+
+            libType = self.library_type(basic, preferred)
+
+            # values in PARTS_COLUMNS order
+            row = (
+                f"C{lcsc}",
+                first_category,
+                second_category,
+                mfr,
+                package,
+                joints,
+                mans[manufacturer_id],
+                libType,
+                description,
+                datasheet,
+                price_str,
+                str(stock),
+            )
+            yield row
+
     def load_tables(self):
         """Load the input data into the output database."""
 
@@ -337,20 +488,21 @@ class Generate:
         res = self.conn_jp.execute("SELECT * FROM categories")
         cats = {i: (c, sc) for i, c, sc in res.fetchall()}
 
-        res = self.conn_jp.execute(
-            f"select count(*) from components {self.component_where_clause()}"
-        )
-        results = res.fetchone()
-        print(f"{humanize.intcomma(results[0])} parts to import")
+        # build the clause once so the count and the import use the same cutoff
+        where_clause = self.component_where_clause()
 
-        price_entries_total = 0
-        price_entries_deleted_total = 0
-        price_entries_duplicates_deleted_total = 0
+        res = self.conn_jp.execute(f"select count(*) from components {where_clause}")
+        parts_to_import = res.fetchone()[0]
+        print(f"{humanize.intcomma(parts_to_import)} parts to import")
+
+        self.price_entries_total = 0
+        self.price_entries_deleted_total = 0
+        self.price_entries_duplicates_deleted_total = 0
+
+        self.seen_categories = set()
 
         self.part_count = 0
         print("Reading components")
-        self.conn_jp.row_factory = sqlite3.Row
-        self.conn.row_factory = sqlite3.Row
         res = self.conn_jp.execute(f"""
             SELECT
                 lcsc,
@@ -361,16 +513,16 @@ class Generate:
                 manufacturer_id,
                 basic,
                 preferred,
-                description,
+                COALESCE(
+                    CASE WHEN json_valid(extra) THEN json_extract(extra, '$.description') END,
+                    description
+                ) AS description,
                 datasheet,
                 stock,
-                price,
-                extra
-            FROM components {self.component_where_clause()}""")
+                price
+            FROM components {where_clause}""")
         while True:
-            comps = res.fetchmany(size=100000)
-
-            print(f"Read {humanize.intcomma(len(comps))} parts")
+            comps = res.fetchmany(size=self.batch_size)
 
             # if we have no more parts exit out of the loop
             if len(comps) == 0:
@@ -379,129 +531,29 @@ class Generate:
             self.part_count += len(comps)
 
             # now extract the data from the jlcparts db and fill
-            # it into the plugin database
-            print("Building parts rows to insert")
-            rows = []
-            for c in comps:
-                priceInput = json.loads(c["price"])
-
-                # parse the price field
-                price = Price(priceInput)
-
-                price_entries = Price.reduce_precision(price.price_entries)
-                price_entries_total += len(price_entries)
-
-                price_str: str = ""
-
-                # filter parts priced below the cutoff value
-                price_entries_cutoff = Price.filter_below_cutoff(price_entries, 0.01)
-                price_entries_deleted_total += len(price_entries) - len(
-                    price_entries_cutoff
-                )
-
-                # alias the variable for the next step
-                price_entries = price_entries_cutoff
-
-                # remove duplicates
-                price_entries_unique = Price.filter_duplicate_prices(price_entries)
-                price_entries_duplicates_deleted_total += len(price_entries) - len(
-                    price_entries_unique
-                )
-                price_entries_deleted_total += len(price_entries) - len(
-                    price_entries_unique
-                )
-
-                # alias over the variable for the next step
-                price_entries = price_entries_unique
-
-                # build the output string that is stored into the parts database
-                price_str = ",".join(
-                    [
-                        f"{entry.min_quantity}-{entry.max_quantity if entry.max_quantity is not None else ''}:{entry.price_dollars_str}"
-                        for entry in price_entries
-                    ]
-                )
+            # it into the plugin database, rows are built as they are inserted
+            self.conn.executemany(PARTS_INSERT_SQL, self.part_rows(comps, cats, mans))
 
-                # default to 'description', override it with the 'description' property from
-                # 'extra' if it exists
-                description = c["description"]
-                extra = {}
-                if c["extra"] is not None:
-                    try:
-                        extra = json.loads(c["extra"])
-                        if "description" in extra:
-                            description = extra["description"]
-                    except Exception:
-                        pass
-
-                # strip ROHS out of descriptions where present
-                # and add 'not ROHS' where ROHS is not present
-                # as 99% of parts are ROHS at this point
-                if " ROHS".lower() not in description.lower():
-                    description += " not ROHS"
-                else:
-                    description = description.replace(" ROHS", "")
-
-                second_category = cats[c["category_id"]][1]
-
-                # strip the 'Second category' out of the description if it
-                # is duplicated there
-                description = description.replace(second_category, "")
-
-                package = c["package"]
-
-                # remove 'Package' from the description if it is duplicated there
-                description = description.replace(package, "")
-
-                # replace double spaces with single spaces in description
-                description.replace("  ", " ")
-
-                # remove trailing spaces from description
-                description = description.strip()
-
-                libType = self.library_type(c)
-
-                row = {
-                    "LCSC Part": f"C{c['lcsc']}",
-                    "First Category": cats[c["category_id"]][0],
-                    "Second Category": cats[c["category_id"]][1],
-                    "MFR.Part": c["mfr"],
-                    "Package": c["package"],
-                    "Solder Joint": int(c["joints"]),
-                    "Manufacturer": mans[c["manufacturer_id"]],
-                    "Library Type": libType,
-                    "Description": description,
-                    "Datasheet": c["datasheet"],
-                    "Price": price_str,
-                    "Stock": str(c["stock"]),
-                }
-                rows.append(row)
-
-            print("Inserting into parts table")
-            # The column names have spaces, so map them to placeholders without spaces
-            data = rows[0]
-            columns = ", ".join([f'"{k}"' for k in data])
-            placeholders = ", ".join(
-                [f":{k.replace(' ', '_').replace('.', '_')}" for k in data]
-            )
-            newrows = [
-                {k.replace(" ", "_").replace(".", "_"): v for k, v in row.items()}
-                for row in rows
-            ]
-            self.conn.executemany(
-                f"INSERT INTO parts ({columns}) VALUES ({placeholders})", newrows
+            # a single progress line per batch
+            print(
+                f"Imported {humanize.intcomma(self.part_count)} of {humanize.intcomma(parts_to_import)} parts"
             )
-            self.conn.commit()
+
+        # commit all batches as a single transaction
+        self.conn.commit()
 
         print(
-            f"Price value filtering trimmed {price_entries_deleted_total} (including {price_entries_duplicates_deleted_total} duplicates) out of {price_entries_total} entries {(price_entries_deleted_total / price_entries_total) * 100 if price_entries_total != 0 else 0:.2f}%"
+            f"Price value filtering trimmed {self.price_entries_deleted_total} (including {self.price_entries_duplicates_deleted_total} duplicates) out of {self.price_entries_total} entries {(self.price_entries_deleted_total / self.price_entries_total) * 100 if self.price_entries_total != 0 else 0:.2f}%"
         )
         print("Done importing parts")
 
     def populate_categories(self):
         """Populate the categories table."""
-        self.conn.execute(
-            'INSERT INTO categories SELECT DISTINCT "First Category", "Second Category" FROM parts ORDER BY UPPER("First Category"), UPPER("Second Category")'
+        # the categories were collected during load_tables, this avoids
+        # a DISTINCT scan over the whole fts5 parts table
+        self.conn.executemany(
+            "INSERT INTO categories VALUES(?, ?)",
+            sorted(self.seen_categories, key=lambda c: (c[0].upper(), c[1].upper())),
         )
 
     def optimize(self):
@@ -510,6 +562,20 @@ class Generate:
         self.conn.execute("insert into parts(parts) values('optimize')")
         print("Done optimizing fts5 parts table")
 
+    def vacuum(self):
+        """Rewrite the database file without the free pages left by the import."""
+        print("Vacuuming parts database")
+        # VACUUM can't run inside a transaction, and its temporary copy of the
+        # database goes to disk as it is as large as the database itself
+        self.conn.commit()
+        self.conn.executescript(
+            """
+            PRAGMA temp_store = FILE;
+            VACUUM;
+            """
+        )
+        print("Done vacuuming parts database")
+
     def build(self):
         """Run all of the steps to generate the database files for upload."""
         self.remove_original()
@@ -518,6 +584,7 @@ class Generate:
         self.load_tables()
         self.populate_categories()
         self.optimize()
+        self.vacuum()
         self.meta_data()
         self.close_sqlite()
         self.compress()
@@ -623,6 +690,23 @@ def test_price_duplicate_price_filter():
     assert unique[len(unique) - 1].max_quantity is None
 
 
+def test_price_duplicate_price_filter_keeps_input():
+    """Price duplicate removal doesn't modify the entries passed in."""
+    prices: list[PriceEntry] = []
+    prices.append(PriceEntry(1, 100, "0.2"))
+    prices.append(PriceEntry(101, 200, "0.1"))
+    prices.append(PriceEntry(201, None, "0.1"))
+
+    unique = Price.filter_duplicate_prices(prices)
+
+    assert len(unique) == 2
+    assert unique[1].min_quantity == 101
+    assert unique[1].max_quantity is None
+
+    # the merged entry is a new object, the input still has its own range
+    assert prices[1].max_quantity == 200
+
+
 @click.command()
 @click.option(
     "--skip-cleanup",
@@ -655,17 +739,24 @@ def test_price_duplicate_price_filter():
         in the source parts database for at least this many days.
     """,
 )
+@click.option(
+    "--download-workers",
+    show_default=True,
+    default=8,
+    type=int,
+    help="Number of upstream parts db files to fetch in parallel",
+)
 def main(
     skip_cleanup: bool,
     fetch_parts_db: bool,
     skip_generate: bool,
     obsolete_parts_threshold_days: int,
+    download_workers: int,
 ):
     """Perform the database steps."""
 
     output_directory = "db_working"
-    if not os.path.exists(output_directory):
-        os.mkdir(output_directory)
+    Path(output_directory).mkdir(exist_ok=True)
     os.chdir(output_directory)
 
     if fetch_parts_db:
@@ -737,17 +828,20 @@ def main(
             )
             sys.exit(1)
 
-        # retrieve each file
+        # retrieve each file, the volumes are independent so fetch them in parallel
         # NOTE: Files start with '1'
-        for part in range(1, file_count + 1):
-            part_file = f"cache.z{part:02d}"
-            print(f"\nGetting file {part_file}")
-            download_progress = DownloadProgress()
-            urllib.request.urlretrieve(
-                f"{base_url}/{part_file}",
-                part_file,
-                reporthook=download_progress.progress_hook,
-            )
+        part_files = [f"cache.z{part:02d}" for part in range(1, file_count + 1)]
+        print(f"\nGetting {len(part_files)} files with {download_workers} workers")
+        with ThreadPoolExecutor(max_workers=download_workers) as executor:
+            futures = {
+                executor.submit(
+                    urllib.request.urlretrieve, f"{base_url}/{part_file}", part_file
+                ): part_file
+                for part_file in part_files
+            }
+            for future in as_completed(futures):
+                future.result()
+                print(f"Got file {futures[future]}")
 
         # extract the database file
         print(f"\nExtracting {first_file}")
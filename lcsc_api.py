@@ -14,10 +14,12 @@ class LCSC_API:
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36"
         }  # pretend we are browser, otherwise their cloud service blocks the request
+        # keep connections alive between the part data, picture and datasheet requests
+        self.session = requests.Session()
 
     def get_part_data(self, lcsc_number: str) -> dict:
         """Get data for a given LCSC number from the API."""
-        r = requests.get(
+        r = self.session.get(
             f"https://cart.jlcpcb.com/shoppingCart/smtGood/getComponentDetail?componentCode={lcsc_number}",
             headers=self.headers,
             timeout=10,
@@ -34,12 +36,12 @@ class LCSC_API:
 
     def download_bitmap(self, url: str) -> Union[io.BytesIO, None]:
         """Download a picture of the part from the API."""
-        content = requests.get(url, headers=self.headers, timeout=10).content
+        content = self.session.get(url, headers=self.headers, timeout=10).content
         return io.BytesIO(content)
 
     def download_datasheet(self, url: str, path: Path):
         """Download and save a datasheet from the API."""
-        r = requests.get(url, stream=True, headers=self.headers, timeout=10)
+        r = self.session.get(url, stream=True, headers=self.headers, timeout=10)
         if r.status_code != requests.codes.ok:  # pylint: disable=no-member
             return {"success": False, "msg": "non-OK HTTP response status"}
         if not r:
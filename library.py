@@ -11,6 +11,8 @@ import time
 from typing import NamedTuple, Optional
 
 import requests  # pylint: disable=import-error
+from requests.adapters import HTTPAdapter  # pylint: disable=import-error
+from urllib3.util import Retry  # pylint: disable=import-error
 import wx  # pylint: disable=import-error
 
 from .events import (
@@ -484,134 +486,161 @@ class Library:
         chunk_file_stub = "parts-fts5.db.zip."
         completed_chunks = set()
 
-        # Check if there is a progress file
-        if os.path.exists(progress_file):
-            with open(progress_file) as f:
-                # Read completed chunk indices from the progress file
-                completed_chunks = {int(line.strip()) for line in f.readlines()}
-
-        # Get the total number of chunks to download
-        try:
-            r = requests.get(
-                url_stub + cnt_file, allow_redirects=True, stream=True, timeout=300
+        # share one session so the count, size checks and chunk downloads reuse
+        # the same connection, transient server errors are retried
+        with requests.Session() as session:
+            session.mount(
+                "https://",
+                HTTPAdapter(
+                    max_retries=Retry(
+                        total=5,
+                        backoff_factor=0.5,
+                        status_forcelist=[429, 500, 502, 503, 504],
+                    )
+                ),
             )
-            if r.status_code != requests.codes.ok:
+
+            # Check if there is a progress file
+            if os.path.exists(progress_file):
+                with open(progress_file) as f:
+                    # Read completed chunk indices from the progress file
+                    completed_chunks = {int(line.strip()) for line in f.readlines()}
+
+            # Get the total number of chunks to download
+            try:
+                r = session.get(
+                    url_stub + cnt_file, allow_redirects=True, stream=True, timeout=300
+                )
+                if r.status_code != requests.codes.ok:
+                    wx.PostEvent(
+                        self.parent,
+                        MessageEvent(
+                            title="HTTP GET Error",
+                            text=f"Failed to fetch count of database parts, error code {r.status_code}\n"
+                            + "URL was:\n"
+                            f"'{url_stub + cnt_file}'",
+                            style="error",
+                        ),
+                    )
+                    self.state = LibraryState.INITIALIZED
+                    return
+
+                # parse the raw body, r.text would guess the charset first
+                total_chunks = int(r.content)
+            except Exception as e:
                 wx.PostEvent(
                     self.parent,
                     MessageEvent(
-                        title="HTTP GET Error",
-                        text=f"Failed to fetch count of database parts, error code {r.status_code}\n"
-                        + "URL was:\n"
-                        f"'{url_stub + cnt_file}'",
+                        title="Download Error",
+                        text=f"Failed to fetch database chunk count, {e}",
                         style="error",
                     ),
                 )
                 self.state = LibraryState.INITIALIZED
                 return
 
-            total_chunks = int(r.text)
-        except Exception as e:
-            wx.PostEvent(
-                self.parent,
-                MessageEvent(
-                    title="Download Error",
-                    text=f"Failed to fetch database chunk count, {e}",
-                    style="error",
-                ),
-            )
-            self.state = LibraryState.INITIALIZED
-            return
-
-        # Re-download incomplete or missing chunks
-        for i in range(total_chunks):
-            chunk_index = i + 1
-            chunk_file = chunk_file_stub + f"{chunk_index:03}"
-            chunk_path = os.path.join(self.datadir, chunk_file)
-
-            # Check if the chunk is logged as completed but the file might be incomplete
-            if chunk_index in completed_chunks:
-                if os.path.exists(chunk_path):
-                    # Validate the size of the chunk file
-                    try:
-                        expected_size = int(
-                            requests.head(
-                                url_stub + chunk_file, timeout=300
-                            ).headers.get("Content-Length", 0)
-                        )
-                        actual_size = os.path.getsize(chunk_path)
-                        if actual_size == expected_size:
-                            self.logger.debug(
-                                "Skipping already downloaded and validated chunk %d.",
-                                chunk_index,
+            # Re-download incomplete or missing chunks
+            for i in range(total_chunks):
+                chunk_index = i + 1
+                chunk_file = chunk_file_stub + f"{chunk_index:03}"
+                chunk_path = os.path.join(self.datadir, chunk_file)
+
+                # Check if the chunk is logged as completed but the file might be incomplete
+                if chunk_index in completed_chunks:
+                    if os.path.exists(chunk_path):
+                        # Validate the size of the chunk file
+                        try:
+                            expected_size = int(
+                                session.head(
+                                    url_stub + chunk_file, timeout=300
+                                ).headers.get("Content-Length", 0)
                             )
-                            continue
-                        else:
+                            actual_size = os.path.getsize(chunk_path)
+                            if actual_size == expected_size:
+                                self.logger.debug(
+                                    "Skipping already downloaded and validated chunk %d.",
+                                    chunk_index,
+                                )
+                                continue
+                            else:
+                                self.logger.warning(
+                                    "Chunk %d is incomplete, re-downloading.",
+                                    chunk_index,
+                                )
+                        except Exception as e:
                             self.logger.warning(
-                                "Chunk %d is incomplete, re-downloading.", chunk_index
+                                "Unable to validate chunk %d, re-downloading. Error: %s",
+                                chunk_index,
+                                e,
                             )
-                    except Exception as e:
+                    else:
                         self.logger.warning(
-                            "Unable to validate chunk %d, re-downloading. Error: %s",
+                            "Chunk %d marked as completed but file is missing, re-downloading.",
                             chunk_index,
-                            e,
                         )
-                else:
-                    self.logger.warning(
-                        "Chunk %d marked as completed but file is missing, re-downloading.",
-                        chunk_index,
-                    )
 
-            # Download the chunk
-            try:
-                with open(chunk_path, "wb") as f:
-                    r = requests.get(
-                        url_stub + chunk_file,
-                        allow_redirects=True,
-                        stream=True,
-                        timeout=300,
-                    )
-                    if r.status_code != requests.codes.ok:
-                        wx.PostEvent(
-                            self.parent,
-                            MessageEvent(
-                                title="Download Error",
-                                text=f"Failed to download chunk {chunk_index}, error code {r.status_code}\n"
-                                + "URL was:\n"
-                                f"'{url_stub + chunk_file}'",
-                                style="error",
-                            ),
+                # Download the chunk
+                try:
+                    with open(chunk_path, "wb") as f:
+                        r = session.get(
+                            url_stub + chunk_file,
+                            allow_redirects=True,
+                            stream=True,
+                            timeout=300,
                         )
-                        self.state = LibraryState.INITIALIZED
-                        return
-
-                    size = int(r.headers.get("Content-Length", 0))
-                    self.logger.debug(
-                        "Downloading chunk %d/%d (%.2f MB)",
-                        chunk_index,
-                        total_chunks,
-                        size / 1024 / 1024,
-                    )
-                    for data in r.iter_content(chunk_size=4096):
-                        f.write(data)
-                        progress = f.tell() / size * 100
-                        wx.PostEvent(self.parent, DownloadProgressEvent(value=progress))
-                    self.logger.debug("Chunk %d downloaded successfully.", chunk_index)
+                        if r.status_code != requests.codes.ok:
+                            wx.PostEvent(
+                                self.parent,
+                                MessageEvent(
+                                    title="Download Error",
+                                    text=f"Failed to download chunk {chunk_index}, error code {r.status_code}\n"
+                                    + "URL was:\n"
+                                    f"'{url_stub + chunk_file}'",
+                                    style="error",
+                                ),
+                            )
+                            self.state = LibraryState.INITIALIZED
+                            return
 
-                # Update progress file after successful download
-                with open(progress_file, "a") as f:
-                    f.write(f"{chunk_index}\n")
+                        size = int(r.headers.get("Content-Length", 0))
+                        self.logger.debug(
+                            "Downloading chunk %d/%d (%.2f MB)",
+                            chunk_index,
+                            total_chunks,
+                            size / 1024 / 1024,
+                        )
+                        # reserve the whole chunk up front so it is allocated in
+                        # one go instead of extent by extent as the data arrives
+                        if size and hasattr(os, "posix_fallocate"):
+                            with contextlib.suppress(OSError):
+                                os.posix_fallocate(f.fileno(), 0, size)
+                        for data in r.iter_content(chunk_size=1024 * 1024):
+                            f.write(data)
+                            progress = f.tell() / size * 100
+                            wx.PostEvent(
+                                self.parent, DownloadProgressEvent(value=progress)
+                            )
+                        # drop any reserved space the body did not fill
+                        f.truncate()
+                        self.logger.debug(
+                            "Chunk %d downloaded successfully.", chunk_index
+                        )
 
-            except Exception as e:
-                wx.PostEvent(
-                    self.parent,
-                    MessageEvent(
-                        title="Download Error",
-                        text=f"Failed to download chunk {chunk_index}, {e}",
-                        style="error",
-                    ),
-                )
-                self.state = LibraryState.INITIALIZED
-                return
+                    # Update progress file after successful download
+                    with open(progress_file, "a") as f:
+                        f.write(f"{chunk_index}\n")
+
+                except Exception as e:
+                    wx.PostEvent(
+                        self.parent,
+                        MessageEvent(
+                            title="Download Error",
+                            text=f"Failed to download chunk {chunk_index}, {e}",
+                            style="error",
+                        ),
+                    )
+                    self.state = LibraryState.INITIALIZED
+                    return
 
         # Delete progress file to indicate the download is complete
         if os.path.exists(progress_file):
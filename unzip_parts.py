@@ -25,25 +25,36 @@ def unzip_parts(parent, path):
     # Set the name of the original file
     db_zip_file = os.path.join(path, "parts-fts5.db.zip")
 
-    # Open the original file for writing
-    with open(db_zip_file, "wb") as db:
-        # Get a list of the split files in the split directory
+    # Get a list of the split files in the split directory, scandir reuses
+    # the file type from the directory listing instead of a stat per entry
+    with os.scandir(path) as entries:
         split_files = [
-            f for f in os.listdir(path) if f.startswith("parts-fts5.db.zip.")
+            (int(e.name.rsplit(".", 1)[-1]), e.path)
+            for e in entries
+            if e.name.startswith("parts-fts5.db.zip.") and e.is_file()
         ]
 
-        # Sort the split files by their index
-        split_files.sort(key=lambda f: int(f.split(".")[-1]))
+    # Sort the split files by their index
+    split_files.sort()
 
+    # The first split file becomes the original file by renaming it, so only
+    # the remaining ones have to be copied
+    if split_files:
+        os.replace(split_files[0][1], db_zip_file)
+        wx.PostEvent(parent, UnzipCombiningProgressEvent(value=100 / len(split_files)))
+
+    # Open the original file for appending
+    with open(db_zip_file, "ab" if split_files else "wb") as db:
+        # Reuse a single buffer for all reads instead of a new bytes object each
+        buffer = memoryview(bytearray(1024 * 1024))
         # Iterate over the split files and append their contents to the original file
-        for i, split_file_name in enumerate(split_files, 1):
-            split_path = os.path.join(path, split_file_name)
+        for i, (_, split_path) in enumerate(split_files[1:], 2):
             # Open the split file
             with open(split_path, "rb") as split_file:
                 # Read the file data
-                while file_data := split_file.read(1024 * 1024):
+                while size := split_file.readinto(buffer):
                     # Append the file data to the original file
-                    db.write(file_data)
+                    db.write(buffer[:size])
 
             # Delete the split file
             os.unlink(split_path)